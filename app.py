@@ -1,106 +1,233 @@
 import streamlit as st
 import json
 import re
-from datetime import datetime
-from typing import Optional, Dict, Any
+import hashlib
+import functools
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Optional, Dict, Any, List, Tuple
 
 # -------------------- GROQ IMPORT --------------------
 try:
+    import httpx
     from groq import Groq
 except ImportError:
     st.error("❌ Groq library not installed. Run: pip install groq")
     st.stop()
 
+# -------------------- ORJSON (OPTIONAL) --------------------
+try:
+    import orjson
+
+    def _loads(content: str) -> Any:
+        return orjson.loads(content)
+
+    def _dumps_pretty(obj: Any) -> str:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+        except TypeError:
+            # orjson refuses integers beyond 64 bits; stdlib json does not
+            return json.dumps(obj, indent=2)
+except ImportError:
+    def _loads(content: str) -> Any:
+        return json.loads(content)
+
+    def _dumps_pretty(obj: Any) -> str:
+        return json.dumps(obj, indent=2)
+
+
+# -------------------- PATTERNS --------------------
+_FENCE_JSON = re.compile(r"^```json\s*")
+_FENCE_BARE = re.compile(r"^```\s*")
+_FENCE_END = re.compile(r"\s*```$")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def _outer_object(content: str) -> str:
+    """Slice out the first balanced {...} with one forward pass."""
+    start = content.find("{")
+    if start < 0:
+        return content
+
+    depth = 0
+    in_str = False
+    escaped = False
+    for i in range(start, len(content)):
+        c = content[i]
+        if in_str:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return content[start:i + 1]
+
+    # Truncated object: keep what we have and let the brace fix close it
+    return content[start:]
+
+
+def _has_open_string(content: str) -> bool:
+    """True if an unescaped quote is left open."""
+    in_str = False
+    escaped = False
+    for c in content:
+        if escaped:
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c == '"':
+            in_str = not in_str
+    return in_str
+
+
+@functools.lru_cache(maxsize=1)
+def _today_cached(bucket: int) -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+_FIELDS = ("material_name", "quantity", "unit", "project_name",
+           "location", "urgency", "deadline")
+_STR_FIELDS = ("material_name", "unit", "project_name", "location")
+_NULLY = frozenset({"", "null", "none", "n/a"})
+_URGENCIES = frozenset({"low", "medium", "high"})
+
+
+def _clean(v: Any) -> Optional[str]:
+    s = str(v).strip() if v is not None else ""
+    return s if s and s.lower() not in _NULLY else None
+
+
+# ==================== GROQ CLIENT ====================
+@st.cache_resource
+def _get_groq_client(api_key: str) -> Groq:
+    """One pooled client per API key, reused across reruns."""
+    http_client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=32),
+        timeout=httpx.Timeout(30.0, connect=3.0)
+    )
+    return Groq(api_key=api_key, http_client=http_client)
+
 
 # ==================== PARSER CLASS ====================
 class MaterialRequestParser:
     """Material order parser using Groq LLM"""
 
     def __init__(self, api_key: str, model: str):
-        self.client = Groq(api_key=api_key)
+        self.client = _get_groq_client(api_key)
         self.model = model
 
     def create_prompt(self, text: str) -> str:
-        today = datetime.now().strftime("%Y-%m-%d")
-
-        return f"""
-You are a construction material order parser.
-Return ONLY valid JSON. No markdown. No explanations.
-
-Rules:
-- All fields must exist
-- Use null for missing values
-- Do not hallucinate
-- Dates must be ISO (YYYY-MM-DD)
-
-Schema:
-{{
-  "material_name": string,
-  "quantity": number,
-  "unit": string,
-  "project_name": string | null,
-  "location": string | null,
-  "urgency": "low" | "medium" | "high",
-  "deadline": string | null
-}}
-
-Urgency:
-- high: asap, urgent, today, 1-3 days
-- medium: within 1-2 weeks
-- low: no urgency
-
-Today is {today}
-
-Text:
-{text}
-"""
-
-    def parse_text(self, text: str):
+        # Refreshed at most once a minute
+        today = _today_cached(int(time.time()) // 60)
+
+        return (
+            f"Today {today}. Extract JSON matching this schema from the order text. "
+            "Schema: {material_name,quantity:number,unit,project_name,location,"
+            "urgency:low|medium|high,deadline:YYYY-MM-DD}. "
+            "Use null for missing; never guess. "
+            "Urgency: high=asap/urgent/today/1-3 days, medium=1-2 weeks, else low.\n"
+            f"Text: {text}"
+        )
+
+    def create_messages(self, text: str) -> List[Dict[str, str]]:
+        return [
+            {
+                "role": "system",
+                "content": "Extract construction order fields as JSON."
+            },
+            {
+                "role": "user",
+                "content": self.create_prompt(text)
+            }
+        ]
+
+    def parse_text(self, text: str, placeholder=None):
+        # Nothing an order could be extracted from: skip the API call
+        stripped = text.strip()
+        if len(stripped) < 4 or not any(c.isalnum() for c in stripped):
+            return self.validate_and_fix({}), None
+
         try:
+            # Stream tokens into the placeholder so output shows up right after
+            # TTFT; fall back to a blocking call if the streamed text won't parse.
+            if placeholder is not None:
+                try:
+                    content = self.stream_completion(text, placeholder)
+                    parsed = self.load_json(content)
+                    return self.validate_and_fix(parsed), None
+                except json.JSONDecodeError:
+                    pass
+
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Return ONLY valid JSON. No markdown. No commentary."
-                    },
-                    {
-                        "role": "user",
-                        "content": self.create_prompt(text)
-                    }
-                ],
-                temperature=0.1,
-                max_tokens=300
+                messages=self.create_messages(text),
+                temperature=0,
+                max_tokens=200,
+                response_format={"type": "json_object"}
             )
 
             content = response.choices[0].message.content.strip()
-            content = self.clean_json_response(content)
-
-            parsed = json.loads(content)
+            parsed = self.load_json(content)
             return self.validate_and_fix(parsed), None
 
         except Exception as e:
             return None, str(e)
 
+    def stream_completion(self, text: str, placeholder) -> str:
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=self.create_messages(text),
+            temperature=0,
+            max_tokens=200,
+            # Groq rejects streaming in JSON mode; load_json cleans the text
+            stream=True
+        )
+
+        buf = []
+        for chunk in response:
+            delta = chunk.choices[0].delta.content or ""
+            if delta:
+                buf.append(delta)
+                placeholder.code("".join(buf), language="json")
+
+        return "".join(buf).strip()
+
     # ---------------- JSON CLEANER ----------------
+    def load_json(self, content: str) -> Any:
+        # Fast path: JSON mode output is normally already valid
+        try:
+            return _loads(content)
+        except json.JSONDecodeError:
+            return _loads(self.clean_json_response(content))
+
     def clean_json_response(self, content: str) -> str:
         # Remove markdown fences
-        content = re.sub(r"^```json\s*", "", content)
-        content = re.sub(r"^```\s*", "", content)
-        content = re.sub(r"\s*```$", "", content)
+        content = _FENCE_JSON.sub("", content)
+        content = _FENCE_BARE.sub("", content)
+        content = _FENCE_END.sub("", content)
 
         content = content.strip()
 
         # Remove trailing commas
-        content = re.sub(r",\s*([}\]])", r"\1", content)
+        content = _TRAILING_COMMA.sub(r"\1", content)
 
         # Extract JSON object
-        match = re.search(r"\{.*\}", content, re.DOTALL)
-        if match:
-            content = match.group(0)
+        content = _outer_object(content)
 
         # Fix quotes
-        if content.count('"') % 2 != 0:
+        if _has_open_string(content):
             content += '"'
 
         # Fix braces
@@ -113,27 +240,24 @@ Text:
 
     # ---------------- VALIDATION ----------------
     def validate_and_fix(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        def clean(val):
-            if val in [None, "", "null", "None", "N/A"]:
-                return None
-            return str(val).strip()
-
-        result = {}
+        result = dict.fromkeys(_FIELDS)
 
-        result["material_name"] = clean(data.get("material_name"))
+        for k in _STR_FIELDS:
+            result[k] = _clean(data.get(k))
 
+        # Numbers from json.loads need no string round-trip
+        q = data.get("quantity")
         try:
-            q = data.get("quantity")
-            result["quantity"] = int(float(q)) if q is not None else None
-        except:
+            if isinstance(q, (int, float)):
+                result["quantity"] = int(q)
+            elif isinstance(q, str) and q.strip():
+                q = q.strip()
+                result["quantity"] = int(q) if q.isdigit() else int(float(q))
+        except (ValueError, OverflowError):
             result["quantity"] = None
 
-        result["unit"] = clean(data.get("unit"))
-        result["project_name"] = clean(data.get("project_name"))
-        result["location"] = clean(data.get("location"))
-
-        urgency = str(data.get("urgency", "low")).lower()
-        result["urgency"] = urgency if urgency in ["low", "medium", "high"] else "low"
+        urgency = str(data.get("urgency", "low")).strip().lower()
+        result["urgency"] = urgency if urgency in _URGENCIES else "low"
 
         result["deadline"] = self.validate_date(data.get("deadline"))
 
@@ -142,14 +266,81 @@ Text:
     def validate_date(self, value) -> Optional[str]:
         if not value:
             return None
+        s = str(value).strip()
+        # Common case: already YYYY-MM-DD, only check it is a real date
+        if _ISO_DATE_RE.match(s):
+            try:
+                date.fromisoformat(s)
+                return s
+            except ValueError:
+                return None
         try:
-            d = datetime.fromisoformat(str(value).replace("Z", ""))
+            d = datetime.fromisoformat(s.replace("Z", ""))
             return d.strftime("%Y-%m-%d")
-        except:
+        except (ValueError, TypeError):
             return None
 
 
+# ==================== RESULT CACHE ====================
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _key_id(api_key: str) -> str:
+    # Short digest so the raw key never lands in Streamlit's cache
+    return hashlib.blake2b(api_key.encode()).hexdigest()[:8]
+
+
+_RESULT_TTL = 3600
+_RESULT_MAX_ENTRIES = 1024
+
+
+@st.cache_resource
+def _result_store() -> Tuple[threading.Lock, OrderedDict]:
+    """Parsed results shared across sessions; holds plain data only, no UI elements."""
+    return threading.Lock(), OrderedDict()
+
+
+def cached_parse(key_id: str, model: str, norm_text: str,
+                 text: str, api_key: str, placeholder=None) -> Dict[str, Any]:
+    """Parse once per (key, model, normalized text); errors are not cached.
+
+    Only a miss calls the API, and only a miss streams into ``placeholder``.
+    """
+    lock, store = _result_store()
+    key = (key_id, model, norm_text)
+    now = time.time()
+    with lock:
+        hit = store.get(key)
+        if hit is not None and now - hit[0] < _RESULT_TTL:
+            store.move_to_end(key)
+            return dict(hit[1])
+
+    result, error = MaterialRequestParser(api_key, model).parse_text(text, placeholder)
+    if error:
+        raise RuntimeError(error)
+
+    with lock:
+        store[key] = (now, result)
+        store.move_to_end(key)
+        while len(store) > _RESULT_MAX_ENTRIES:
+            store.popitem(last=False)
+    return dict(result)
+
+
 # ==================== STREAMLIT UI ====================
+# Built once at import instead of on every rerun
+_MODEL_OPTIONS = {
+    "Llama 3.1 8B Instant (Fastest)": "llama-3.1-8b-instant",
+    "Llama 3.3 70B (Best)": "llama-3.3-70b-versatile",
+    "Mixtral 8x7B": "mixtral-8x7b-32768",
+    "Gemma 2 9B": "gemma2-9b-it"
+}
+_MODEL_NAMES = list(_MODEL_OPTIONS)
+
+_EXAMPLE_TEXT = "Need 350 bags of Ultratech cement for Mumbai site urgently in 7 days"
+
+
 def main():
     st.set_page_config(
         page_title="Material Order Parser",
@@ -165,22 +356,15 @@ def main():
     with st.sidebar:
         st.header("⚙️ Configuration")
 
-        models = {
-            "Llama 3.3 70B (Best)": "llama-3.3-70b-versatile",
-            "Llama 3.1 8B (Fast)": "llama-3.1-8b-instant",
-            "Mixtral 8x7B": "mixtral-8x7b-32768",
-            "Gemma 2 9B": "gemma2-9b-it"
-        }
-
-        model_name = st.selectbox("Model", list(models.keys()))
-        model = models[model_name]
+        model_name = st.selectbox("Model", _MODEL_NAMES)
+        model = _MODEL_OPTIONS[model_name]
 
         api_key = st.text_input("Groq API Key", type="password")
 
         st.markdown("---")
         st.markdown("### 📌 Example")
         if st.button("Load Example"):
-            st.session_state.text = "Need 350 bags of Ultratech cement for Mumbai site urgently in 7 days"
+            st.session_state.text = _EXAMPLE_TEXT
 
     # ---------------- MAIN ----------------
     col1, col2 = st.columns(2)
@@ -199,15 +383,21 @@ def main():
             elif not text.strip():
                 st.warning("Enter some text")
             else:
+                stream_box = st.empty()
                 with st.spinner("Parsing..."):
-                    parser = MaterialRequestParser(api_key, model)
-                    result, error = parser.parse_text(text)
-
-                    if error:
-                        st.error(error)
-                    else:
-                        st.session_state.result = result
-                        st.success("Parsed successfully")
+                    try:
+                        result = cached_parse(_key_id(api_key), model, _normalize(text),
+                                              text, api_key, stream_box)
+                        error = None
+                    except RuntimeError as e:
+                        result, error = None, str(e)
+                stream_box.empty()
+
+                if error:
+                    st.error(error)
+                else:
+                    st.session_state.result = result
+                    st.success("Parsed successfully")
 
     with col2:
         st.subheader("📤 Output")
@@ -217,7 +407,7 @@ def main():
 
             st.download_button(
                 "⬇️ Download JSON",
-                json.dumps(st.session_state.result, indent=2),
+                _dumps_pretty(st.session_state.result),
                 "material_order.json",
                 "application/json"
             )
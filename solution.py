@@ -1,14 +1,323 @@
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import hashlib
+import itertools
 import json
 import re
 import os
-from datetime import datetime
-from typing import Optional, Dict, Any, List, Union
+from collections import OrderedDict
+from multiprocessing import Pool
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional, Tuple, Union
 
 try:
-    from groq import Groq
+    import httpx
+    from groq import (APIConnectionError, APIError, APIStatusError, AsyncGroq, Groq,
+                      RateLimitError)
 except ImportError:
     raise ImportError("Install Groq: pip install groq")
 
+# orjson is optional; stdlib json is the fallback
+try:
+    import orjson
+
+    def _loads(content: Union[str, bytes]) -> Any:
+        return orjson.loads(content)
+
+    def _dumps(obj: Any, indent: bool = False) -> str:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+        except TypeError:
+            # orjson refuses integers beyond 64 bits; stdlib json does not
+            return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False)
+except ImportError:
+    def _loads(content: Union[str, bytes]) -> Any:
+        return json.loads(content)
+
+    def _dumps(obj: Any, indent: bool = False) -> str:
+        return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False)
+
+
+_FIELDS = ("material_name", "quantity", "unit", "project_name",
+           "location", "urgency", "deadline")
+_STR_FIELDS = ("material_name", "unit", "project_name", "location")
+_NULLY = frozenset({"", "null", "none", "n/a"})
+_URGENCIES = frozenset({"low", "medium", "high"})
+
+
+def _clean(v: Any) -> Optional[str]:
+    s = str(v).strip() if v is not None else ""
+    return s if s and s.lower() not in _NULLY else None
+
+
+@functools.lru_cache(maxsize=1)
+def _shared_http_client() -> "httpx.Client":
+    """Keep-alive pool shared by every parser in the process."""
+    return httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+        timeout=30.0
+    )
+
+
+def _normalize(text: str) -> str:
+    """Collapse case and whitespace so trivially different lines share a key."""
+    return " ".join(text.lower().split())
+
+
+_FENCE_RE = re.compile(r"```(?:json)?", re.IGNORECASE)
+# Every boundary str.splitlines() splits on, not just "\n"
+_LINE_BREAK_RE = re.compile("[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+# google-re2 (linear-time, no backtracking) is optional; stdlib re is the fallback
+try:
+    import re2
+    _ISO_DATE_RE = re2.compile(r"^\d{4}-\d{2}-\d{2}$")
+except ImportError:
+    _ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_DECODER = json.JSONDecoder()
+
+# Speed/quality tiers selectable per parse() call
+SPEED_MAP = {
+    "instant": "llama-3.1-8b-instant",
+    "balanced": "llama-3.3-70b-versatile",
+}
+
+_SYSTEM_PROMPT = "Extract construction material orders. Return ONLY valid JSON."
+_STRICT_SYSTEM_PROMPT = (_SYSTEM_PROMPT + " Your previous reply was not parseable. "
+                         "Output a single JSON value and nothing else.")
+_MAX_RETRIES = 4
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """Rate limits, 5xx and network errors are worth retrying; other 4xx are not."""
+    if isinstance(exc, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(exc, APIStatusError) and exc.status_code >= 500
+
+
+def _backoff(attempt: int, exc: Optional[Exception] = None) -> float:
+    """Seconds to wait before a retry; a server Retry-After header wins when present."""
+    response = getattr(exc, "response", None)
+    if response is not None:
+        try:
+            return max(0.0, min(30, float(response.headers.get("retry-after"))))
+        except (TypeError, ValueError):
+            pass
+    return min(30, 2 ** attempt + random.random())
+
+
+def _with_retries(call: Callable[[], Any]) -> Any:
+    for attempt in range(_MAX_RETRIES + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == _MAX_RETRIES or not _is_retryable(e):
+                raise
+            time.sleep(_backoff(attempt, e))
+
+
+async def _awith_retries(call: Callable[[], Awaitable[Any]]) -> Any:
+    for attempt in range(_MAX_RETRIES + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == _MAX_RETRIES or not _is_retryable(e):
+                raise
+            await asyncio.sleep(_backoff(attempt, e))
+
+
+# Rule-based fast path for templated lines such as "500 bags cement urgent"
+QTY_UNIT_RE = re.compile(
+    r"\b(\d+(?:\.\d+)?)\s*(bags?|kg|tons?|pieces?|pcs|units?|truckloads?)\b", re.I)
+URGENCY_RE = re.compile(r"\b(urgent|urgently|asap|immediately|critical)\b", re.I)
+MATERIALS = frozenset({"cement", "sand", "steel", "bricks", "brick", "gravel",
+                       "aggregates", "rebar", "tiles", "gypsum", "concrete"})
+_FILLER = frozenset({"i", "need", "needed", "want", "order", "get", "me",
+                     "send", "please", "of", "required"})
+
+# Bump whenever the prompts change so cached results are not reused
+_PROMPT_VERSION = 4
+
+
+class LLMCache:
+    """Small SQLite store of validated results, keyed by request hash."""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache(k TEXT PRIMARY KEY, v TEXT)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute("SELECT v FROM cache WHERE k = ?", (key,)).fetchone()
+        return _loads(row[0]) if row else None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO cache(k, v) VALUES (?, ?)",
+                           (key, _dumps(value)))
+        self._conn.commit()
+
+
+class _JsonStreamScanner:
+    """
+    Finds where the first top-level JSON value ends in streamed text.
+    Depth and string/escape state carry over between chunks, so each
+    character is looked at exactly once.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_str = False
+        self.escaped = False
+        self.seen = 0
+
+    def feed(self, chunk: str) -> Optional[int]:
+        """Offset just past the closing bracket once it arrives, else None."""
+        for i, c in enumerate(chunk):
+            if self.in_str:
+                if self.escaped:
+                    self.escaped = False
+                elif c == "\\":
+                    self.escaped = True
+                elif c == '"':
+                    self.in_str = False
+            elif c == '"':
+                self.in_str = True
+            elif c in "{[":
+                self.depth += 1
+            elif c in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    return self.seen + i + 1
+        self.seen += len(chunk)
+        return None
+
+
+class _StreamReader:
+    """Collects streamed deltas until the first JSON value in them is complete."""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.scanner = _JsonStreamScanner()
+        self.end: Optional[int] = None
+
+    def feed(self, chunk: Any) -> bool:
+        """Add one stream chunk; True once the rest of the stream can be dropped."""
+        if not chunk.choices:
+            return False
+        delta = chunk.choices[0].delta.content or ""
+        self.parts.append(delta)
+        self.end = self.scanner.feed(delta)
+        return self.end is not None
+
+    def text(self) -> str:
+        return "".join(self.parts)[:self.end].strip()
+
+
+_NUMBERS_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+_WORDS_RE = re.compile(r"\w+")
+
+
+def _words(text: str) -> frozenset:
+    return frozenset(_WORDS_RE.findall(text.lower()))
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache over local sentence embeddings, so paraphrases
+    of an earlier order reuse its parse. Needs sentence-transformers and
+    faiss; the encoder is loaded on first use. Entries are kept per LLM
+    model and day, at most max_entries each, oldest dropped first; a new
+    day drops every earlier day's entries.
+    """
+
+    def __init__(self, threshold: float = 0.93, model_name: str = "all-MiniLM-L6-v2",
+                 max_entries: int = 4096):
+        try:
+            import faiss
+            import numpy as np
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("Install semantic cache deps: pip install sentence-transformers faiss-cpu")
+
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._model_name = model_name
+        self._sentence_transformer = SentenceTransformer
+        self._faiss = faiss
+        self._np = np
+        self._encoder = None
+        # (LLM model, day) -> (index, entries); entry i is row i of the index
+        self._scopes: Dict[Tuple[str, str], Tuple[Any, List[Tuple[Any, ...]]]] = {}
+        self._pending: Dict[str, Any] = {}
+
+    def _encode(self, texts: List[str]):
+        if self._encoder is None:
+            self._encoder = self._sentence_transformer(self._model_name)
+        return self._encoder.encode(texts, normalize_embeddings=True).astype("float32")
+
+    def get_many(self, texts: List[str], model: str,
+                 day: str) -> List[Optional[Dict[str, Any]]]:
+        """One forward pass for all texts; None where no close neighbour exists."""
+        if not texts:
+            return []
+
+        embs = self._encode(texts)
+        # Kept only until the misses from this lookup are added
+        self._pending = dict(zip(texts, embs))
+        scope = self._scopes.get((model, day))
+        if scope is None or scope[0].ntotal == 0:
+            return [None] * len(texts)
+
+        index, entries = scope
+        scores, ids = index.search(embs, 1)
+        hits = []
+        for text, score, idx in zip(texts, scores[:, 0], ids[:, 0]):
+            numbers, names, result, _ = entries[idx]
+            # "50 bags" and "500 bags", or "Project Alpha" and "Project Beta",
+            # embed closely; numbers must match and names must all reappear
+            if (score >= self.threshold and numbers == tuple(_NUMBERS_RE.findall(text))
+                    and names <= _words(text)):
+                hits.append(dict(result))
+            else:
+                hits.append(None)
+        return hits
+
+    def add(self, text: str, result: Dict[str, Any], model: str, day: str) -> None:
+        emb = self._pending.pop(text, None)
+        if emb is None:
+            emb = self._encode([text])[0]
+
+        scope = self._scopes.get((model, day))
+        if scope is None:
+            # Relative deadlines from earlier days are stale; drop those scopes
+            for key in [k for k in self._scopes if k[1] != day]:
+                del self._scopes[key]
+            scope = self._scopes[(model, day)] = (self._faiss.IndexFlatIP(emb.shape[0]), [])
+        index, entries = scope
+
+        names = frozenset().union(*(_words(result[k]) for k in
+                                    ("material_name", "project_name", "location")
+                                    if result.get(k)))
+        index.add(emb.reshape(1, -1))
+        entries.append((tuple(_NUMBERS_RE.findall(text)), names, dict(result), emb))
+
+        if len(entries) > self.max_entries:
+            # Flat indexes cannot drop rows cheaply; rebuild from the newest
+            # three quarters so this runs once per max_entries / 4 additions
+            del entries[:len(entries) - self.max_entries * 3 // 4]
+            index.reset()
+            index.add(self._np.stack([e[3] for e in entries]))
+
 
 class MaterialRequestParser:
     """
@@ -19,136 +328,560 @@ class MaterialRequestParser:
     """
 
     def __init__(self, api_key: Optional[str] = None,
-                 model: str = "llama-3.3-70b-versatile"):
+                 model: str = "llama-3.1-8b-instant",
+                 max_concurrency: int = 20,
+                 batch_size: int = 8,
+                 cache_path: Optional[str] = None,
+                 escalation_model: Optional[str] = "llama-3.3-70b-versatile",
+                 memory_cache_size: int = 4096,
+                 semantic_threshold: Optional[float] = None,
+                 stream: bool = True,
+                 coalesce_window: float = 0.02):
         self.api_key = api_key or os.getenv("GROQ_API_KEY")
         if not self.api_key:
             raise ValueError("GROQ_API_KEY not set")
 
-        self.client = Groq(api_key=self.api_key)
+        # Retries are handled by _with_retries, not stacked on the SDK's own
+        self.client = Groq(api_key=self.api_key, http_client=_shared_http_client(),
+                           max_retries=0)
         self.model = model
+        # Larger model retried only for rows the default one could not name a material for
+        self.escalation_model = escalation_model
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.temperature = 0
+        # Stream plain-text replies and stop reading once the JSON value is
+        # complete; JSON-mode calls are never streamed
+        self.stream = stream
+        # In-memory LRU in front of the optional on-disk cache
+        self.cache = LLMCache(cache_path) if cache_path else None
+        self.memory_cache_size = memory_cache_size
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._memory_day: Optional[str] = None
+        # Opt-in: paraphrase matching on local embeddings
+        self.semantic_cache = (SemanticCache(semantic_threshold)
+                               if semantic_threshold is not None else None)
+        self._date_cached: Tuple[Optional[date], Optional[str]] = (None, None)
+
+        # parse_async() callers arriving within coalesce_window share one dispatch
+        self.coalesce_window = coalesce_window
+        self._coalesce_pending: List[Tuple[str, asyncio.Future]] = []
+        self._coalesce_handle: Optional[asyncio.TimerHandle] = None
+        self._coalesce_tasks: set = set()
+
+        # Async client and concurrency limit are bound to the event loop they were created on
+        self._aclient: Optional[AsyncGroq] = None
+        self._aclient_loop = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._sem_loop = None
+
+    async def __aenter__(self) -> "MaterialRequestParser":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
 
     # ---------------- AUTO-DETECTION ----------------
     def split_requests(self, text: str) -> List[str]:
-        lines = [l.strip() for l in text.splitlines() if l.strip()]
-        return lines
+        return [s for s in (l.strip() for l in text.splitlines()) if s]
 
     def is_batch_input(self, text: str) -> bool:
         return len(self.split_requests(text)) > 1
 
     # ---------------- PROMPTS ----------------
-    def create_single_prompt(self, text: str) -> str:
-        today = datetime.now().strftime("%Y-%m-%d")
-        return f"""
-You are a construction material order parser.
-
-Return ONLY one valid JSON object.
-No markdown. No explanation. No extra text.
-
-Schema:
-{{
-  "material_name": string,
-  "quantity": number | null,
-  "unit": string | null,
-  "project_name": string | null,
-  "location": string | null,
-  "urgency": "low" | "medium" | "high",
-  "deadline": string | null
-}}
-
-Rules:
-- Use null if missing
-- Dates must be YYYY-MM-DD
-- Do not hallucinate
-
-Today: {today}
-
-Input:
-{text}
-"""
+    # Static parts are built once; only the date and inputs vary per call.
+    # Single and batch prompts share the same leading block so a provider
+    # prefix cache can reuse it across both.
+    _PROMPT_HEAD = (
+        "Schema: material_name:str quantity:int|null unit:str|null "
+        "project_name:str|null location:str|null urgency:low|medium|high "
+        "deadline:YYYY-MM-DD|null\n"
+        "Rules: null if missing; do not guess.\n"
+    )
 
-    def create_batch_prompt(self, requests: List[str]) -> str:
-        today = datetime.now().strftime("%Y-%m-%d")
-        numbered = "\n".join(f"{i+1}. {r}" for i, r in enumerate(requests))
+    _SINGLE_PROMPT_PREFIX = _PROMPT_HEAD + "Return one JSON object.\n"
 
-        return f"""
-You are a construction material order parser.
+    _BATCH_PROMPT_PREFIX = (_PROMPT_HEAD +
+                            'Return {"results": [...]}, one element per input line, in order.\n')
 
-Return a VALID JSON ARRAY.
-Each array element corresponds EXACTLY to one input line.
-Array length must be {len(requests)}.
+    def _today(self) -> str:
+        # Re-format only when the day rolls over
+        d = date.today()
+        if d != self._date_cached[0]:
+            self._date_cached = (d, d.isoformat())
+        return self._date_cached[1]
 
-No markdown. No explanation. No extra text.
+    def create_single_prompt(self, text: str) -> str:
+        return f"{self._SINGLE_PROMPT_PREFIX}Today: {self._today()}\nInput: {text}\n"
 
-Schema for EACH element:
-{{
-  "material_name": string,
-  "quantity": number | null,
-  "unit": string | null,
-  "project_name": string | null,
-  "location": string | null,
-  "urgency": "low" | "medium" | "high",
-  "deadline": string | null
-}}
+    def create_batch_prompt(self, requests: List[str]) -> str:
+        numbered = "\n".join(f"{i+1}. {r}" for i, r in enumerate(requests))
+        return (f"{self._BATCH_PROMPT_PREFIX}Today: {self._today()}\n"
+                f"Array length: {len(requests)}\nInputs:\n{numbered}\n")
 
-Rules:
-- Preserve input order
-- Use null if missing
-- Dates must be YYYY-MM-DD
-- Do not hallucinate
+    # ---------------- FAST PATH ----------------
+    def fast_path_parse(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Resolve a line without the LLM when it is only quantity, unit,
+        known material, urgency and filler words. Returns None otherwise.
+        """
+        matches = QTY_UNIT_RE.findall(text)
+        if len(matches) != 1:
+            return None
+        quantity, unit = matches[0]
 
-Today: {today}
+        rest = URGENCY_RE.sub(" ", QTY_UNIT_RE.sub(" ", text))
+        materials = []
+        for word in rest.split():
+            w = word.strip(",.!").lower()
+            if w in MATERIALS:
+                materials.append(word.strip(",.!"))
+            elif w and w not in _FILLER:
+                # Anything else (project, place, size, date) needs the LLM
+                return None
+
+        if not materials:
+            return None
 
-Inputs:
-{numbered}
-"""
+        return {
+            "material_name": " ".join(materials),
+            "quantity": quantity,
+            "unit": unit,
+            "urgency": "high" if URGENCY_RE.search(text) else "low",
+        }
 
     # ---------------- PUBLIC ENTRY ----------------
-    def parse(self, text: str) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
-        if self.is_batch_input(text):
-            return self.parse_batch_text(text)
-        return self.parse_single_text(text)
+    def parse(self, text: str,
+              tier: Optional[Literal["instant", "balanced"]] = None
+              ) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        parser = self._for_model(SPEED_MAP[tier]) if tier else self
+        # Common case: one line, no split needed
+        if not _LINE_BREAK_RE.search(text.strip()):
+            return parser.parse_single_text(text)
+        # Split once and hand the lines on rather than re-splitting for batches
+        lines = parser.split_requests(text)
+        if len(lines) > 1:
+            return parser.parse_batch_text_lines(lines)
+        return parser.parse_single_text(lines[0] if lines else text)
+
+    def _for_model(self, model: str) -> "MaterialRequestParser":
+        # Shallow copy shares clients and caches; cache keys include the model
+        if model == self.model:
+            return self
+        clone = copy.copy(self)
+        clone.model = model
+        return clone
 
     # ---------------- SINGLE ----------------
     def parse_single_text(self, text: str) -> Dict[str, Any]:
-        raw = self.call_llm(self.create_single_prompt(text))
-        obj = self.extract_json(raw)
-        return self.validate_and_fix(obj)
+        cached = self._cache_get(text)
+        if cached is not None:
+            return cached
+
+        fast = self.fast_path_parse(text)
+        if fast is not None:
+            return self.validate_and_fix(fast)
+
+        if self.semantic_cache is not None:
+            similar = self.semantic_cache.get_many([text], self.model, self._today())[0]
+            if similar is not None:
+                return similar
+
+        prompt = self.create_single_prompt(text)
+        try:
+            obj = self.extract_json(self.call_llm(prompt, json_mode=True))
+        except ValueError:
+            # Unparseable reply: ask once more with a stricter system message
+            obj = self.extract_json(self.call_llm(prompt, strict=True, json_mode=True))
+        result = self.validate_and_fix(obj)
+
+        if self._needs_escalation(text, result):
+            try:
+                raw = self.call_llm(prompt, json_mode=True, model=self.escalation_model)
+                result = self.validate_and_fix(self.extract_json(raw))
+            except (ValueError, APIError):
+                # Keep the default model's answer if the larger one fails
+                pass
+        self._cache_set(text, result)
+        return result
 
     # ---------------- BATCH ----------------
     def parse_batch_text(self, text: str) -> List[Dict[str, Any]]:
-        requests = self.split_requests(text)
-        raw = self.call_llm(self.create_batch_prompt(requests))
-        arr = self.extract_json(raw, expect_array=True)
+        return self.parse_batch_text_lines(self.split_requests(text))
+
+    def parse_batch_text_lines(self, requests: List[str]) -> List[Dict[str, Any]]:
+        return self._run(lambda parser: parser.aparse_batch_lines(requests))
+
+    def _run(self, make_coro: Callable[["MaterialRequestParser"], Awaitable[Any]]) -> Any:
+        """
+        Run make_coro(parser) on a fresh event loop, then close that loop's
+        client. Sync callers that already sit in a running loop (Jupyter,
+        async handlers) get the run on a worker thread instead.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._run_and_close(make_coro))
+
+        # A shallow copy shares the caches but not the caller loop's client
+        # or semaphore, which must not be replaced from another thread
+        runner = copy.copy(self)
+        runner._aclient = runner._aclient_loop = None
+        runner._sem = runner._sem_loop = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(asyncio.run, runner._run_and_close(make_coro)).result()
+
+    async def _run_and_close(self, make_coro):
+        try:
+            return await make_coro(self)
+        finally:
+            await self.aclose()
+
+    async def aparse_batch(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Batch entry point for callers already running an event loop.
+        The parser opens an async client on that loop; release it with
+        ``await parser.aclose()`` or use ``async with parser:``.
+        """
+        return await self.aparse_batch_lines(self.split_requests(text))
+
+    async def aparse_batch_lines(self, requests: List[str]) -> List[Dict[str, Any]]:
+        # Collapse repeated lines so each distinct order is sent once
+        unique: Dict[str, Tuple[str, List[int]]] = {}
+        for i, line in enumerate(requests):
+            key = _normalize(line)
+            unique.setdefault(key, (line, []))[1].append(i)
+
+        originals = [orig for orig, _ in unique.values()]
+        parsed = await self.parse_batch_async(originals)
 
+        results: List[Dict[str, Any]] = [None] * len(requests)
+        for item, (_, idxs) in zip(parsed, unique.values()):
+            for i in idxs:
+                results[i] = dict(item)
+
+        return results
+
+    async def parse_batch_async(self, requests: List[str]) -> List[Dict[str, Any]]:
         results = []
-        for i, item in enumerate(arr):
-            try:
-                results.append(self.validate_and_fix(item))
-            except Exception:
-                results.append(self.create_fallback_response(requests[i]))
+        for r in requests:
+            hit = self._cache_get(r)
+            if hit is None:
+                fast = self.fast_path_parse(r)
+                hit = self.validate_and_fix(fast) if fast is not None else None
+            results.append(hit)
+
+        if self.semantic_cache is not None:
+            pending = [i for i, hit in enumerate(results) if hit is None]
+            similar = self.semantic_cache.get_many([requests[i] for i in pending],
+                                                   self.model, self._today())
+            for i, hit in zip(pending, similar):
+                results[i] = hit
+
+        misses = [r for r, hit in zip(requests, results) if hit is None]
+
+        # batch_size lines per prompt, at most max_concurrency prompts in flight
+        sem = self._semaphore()
+        k = self.batch_size
+        chunks = [misses[i:i + k] for i in range(0, len(misses), k)]
+
+        parsed = await asyncio.gather(*(self._parse_chunk_async(sem, c) for c in chunks))
+        fresh = [item for chunk in parsed for item in chunk]
+
+        retry = [n for n, item in enumerate(fresh)
+                 if item is not None and self._needs_escalation(misses[n], item)]
+        if retry:
+            redo = await asyncio.gather(
+                *(self._parse_one_async(sem, misses[n], model=self.escalation_model)
+                  for n in retry),
+                return_exceptions=True
+            )
+            for n, o in zip(retry, redo):
+                if not isinstance(o, BaseException):
+                    fresh[n] = o
+        fresh = iter(fresh)
+
+        for i, hit in enumerate(results):
+            if hit is not None:
+                continue
+            item = next(fresh)
+            if item is None:
+                results[i] = self.create_fallback_response(requests[i])
+            else:
+                self._cache_set(requests[i], item)
+                results[i] = item
 
         return results
 
+    async def _parse_chunk_async(self, sem: asyncio.Semaphore,
+                                 requests: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Parsed rows for one chunk, None where a row could not be parsed."""
+        if len(requests) > 1:
+            try:
+                async with sem:
+                    raw = await self.acall_llm(self.create_batch_prompt(requests),
+                                               max_tokens=120 * len(requests),
+                                               json_mode=True)
+                arr = self.extract_json(raw, expect_array=True)
+                if len(arr) == len(requests):
+                    # validate_and_fix cannot raise on a dict, so only the
+                    # type check is needed per row; alias it for the loop
+                    validate = self.validate_and_fix
+                    return [validate(item) if isinstance(item, dict) else None
+                            for item in arr]
+            except ValueError:
+                # Unreadable array: handled per line below. API errors are
+                # not, since re-sending every row would only repeat them.
+                pass
+
+        # Wrong length or unreadable array: one request per line instead
+        outcomes = await asyncio.gather(
+            *(self._parse_one_async(sem, r) for r in requests),
+            return_exceptions=True
+        )
+        for o in outcomes:
+            if isinstance(o, APIError):
+                raise o
+        return [None if isinstance(o, BaseException) else o for o in outcomes]
+
+    def _needs_escalation(self, text: str, result: Dict[str, Any]) -> bool:
+        # Blank or punctuation-only input has no material for any model to find
+        return (bool(self.escalation_model) and self.escalation_model != self.model
+                and result["material_name"] is None and any(c.isalnum() for c in text))
+
+    async def _parse_one_async(self, sem: asyncio.Semaphore, text: str,
+                               model: Optional[str] = None) -> Dict[str, Any]:
+        prompt = self.create_single_prompt(text)
+        async with sem:
+            raw = await self.acall_llm(prompt, json_mode=True, model=model)
+            try:
+                obj = self.extract_json(raw)
+            except ValueError:
+                obj = self.extract_json(await self.acall_llm(prompt, strict=True,
+                                                             json_mode=True, model=model))
+        return self.validate_and_fix(obj)
+
+    # ---------------- COALESCING ----------------
+    async def parse_async(self, text: str) -> Dict[str, Any]:
+        """
+        Parse one request from async code. Calls that arrive within
+        coalesce_window of each other are sent as one batch and each
+        caller gets its own row back. As with aparse_batch, close the
+        loop's client with ``await parser.aclose()`` or ``async with parser:``.
+        """
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._coalesce_pending.append((text, fut))
+        if self._coalesce_handle is None:
+            self._coalesce_handle = loop.call_later(self.coalesce_window, self._flush_pending)
+        return await fut
+
+    def _flush_pending(self) -> None:
+        self._coalesce_handle = None
+        pending, self._coalesce_pending = self._coalesce_pending, []
+        task = asyncio.ensure_future(self._flush(pending))
+        # Hold a reference until done so the task is not garbage collected
+        self._coalesce_tasks.add(task)
+        task.add_done_callback(self._coalesce_tasks.discard)
+
+    async def _flush(self, pending: List[Tuple[str, asyncio.Future]]) -> None:
+        try:
+            results = await self.aparse_batch_lines([text for text, _ in pending])
+        except Exception as e:
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        for (_, fut), result in zip(pending, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    # ---------------- FILES ----------------
+    def process_file(self, input_path: str, output_path: str) -> int:
+        """
+        Parse a file of one request per line into JSON Lines.
+        Input is read and results are written one window at a time.
+        """
+        # Opening the output with "w" would empty the input before it is read
+        if os.path.exists(output_path) and os.path.samefile(input_path, output_path):
+            raise ValueError(f"Output path is the input file: {output_path}")
+
+        # One event loop, and so one connection pool, for the whole file
+        return self._run(lambda parser: parser._aprocess_file(input_path, output_path))
+
+    async def _aprocess_file(self, input_path: str, output_path: str) -> int:
+        window = self.batch_size * self.max_concurrency
+        count = 0
+
+        with open(input_path, encoding="utf-8") as src, \
+                open(output_path, "w", encoding="utf-8", buffering=1024 * 1024) as out:
+            lines = (s for s in (raw.strip() for raw in src) if s)
+            while True:
+                batch = list(itertools.islice(lines, window))
+                if not batch:
+                    break
+
+                for text, result in zip(batch, await self.aparse_batch_lines(batch)):
+                    out.write(_dumps({"input": text, "output": result}) + "\n")
+                # Keep finished windows on disk if a later one fails
+                out.flush()
+                count += len(batch)
+
+        return count
+
+    # ---------------- CACHE ----------------
+    def _cache_key(self, text: str) -> str:
+        # Relative deadlines ("in 7 days") resolve against the prompt's date,
+        # so a result is only valid on the day it was produced
+        payload = {"model": self.model, "text": _normalize(text),
+                   "prompt_version": _PROMPT_VERSION, "today": self._today()}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def _cache_get(self, text: str) -> Optional[Dict[str, Any]]:
+        # Only deterministic completions are safe to replay
+        if self.temperature > 0:
+            return None
+
+        key = self._cache_key(text)
+        hit = self._memory.get(key)
+        if hit is not None:
+            self._memory.move_to_end(key)
+            return dict(hit)
+
+        if self.cache is not None:
+            hit = self.cache.get(key)
+            if hit is not None:
+                self._remember(key, hit)
+                return dict(hit)
+
+        return None
+
+    def _cache_set(self, text: str, result: Dict[str, Any]) -> None:
+        if self.temperature > 0:
+            return
+
+        key = self._cache_key(text)
+        self._remember(key, dict(result))
+        if self.cache is not None:
+            self.cache.set(key, result)
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(text, result, self.model, self._today())
+
+    def _remember(self, key: str, result: Dict[str, Any]) -> None:
+        # Keys carry the date; earlier days' entries can never hit again
+        today = self._today()
+        if today != self._memory_day:
+            self._memory.clear()
+            self._memory_day = today
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_cache_size:
+            self._memory.popitem(last=False)
+
     # ---------------- LLM CALL ----------------
-    def call_llm(self, prompt: str) -> str:
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": "Return ONLY valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,
-            max_tokens=800
+    def _messages(self, prompt: str, strict: bool = False) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": _STRICT_SYSTEM_PROMPT if strict else _SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _response_format(self, json_mode: bool) -> Dict[str, Any]:
+        # JSON mode only guarantees an object; batch prompts ask for the
+        # array wrapped as {"results": [...]} so they can use it too
+        return {"response_format": {"type": "json_object"}} if json_mode else {}
+
+    def _request(self, prompt: str, max_tokens: int, strict: bool, json_mode: bool,
+                 model: Optional[str]) -> Dict[str, Any]:
+        return dict(
+            model=model or self.model,
+            messages=self._messages(prompt, strict),
+            temperature=self.temperature,
+            max_tokens=max_tokens,
+            # Groq rejects streaming together with JSON mode
+            stream=self.stream and not json_mode,
+            **self._response_format(json_mode)
         )
-        return response.choices[0].message.content.strip()
+
+    def call_llm(self, prompt: str, max_tokens: int = 256, strict: bool = False,
+                 json_mode: bool = False, model: Optional[str] = None) -> str:
+        request = self._request(prompt, max_tokens, strict, json_mode, model)
+
+        def attempt() -> str:
+            response = self.client.chat.completions.create(**request)
+            if not request["stream"]:
+                return response.choices[0].message.content.strip()
+            reader = _StreamReader()
+            try:
+                for chunk in response:
+                    if reader.feed(chunk):
+                        break
+            finally:
+                response.close()
+            return reader.text()
+
+        return _with_retries(attempt)
+
+    def _async_client(self) -> AsyncGroq:
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            http_client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+                timeout=30.0
+            )
+            # Retries are handled by _awith_retries, not stacked on the SDK's own
+            self._aclient = AsyncGroq(api_key=self.api_key, http_client=http_client,
+                                      max_retries=0)
+            self._aclient_loop = loop
+        return self._aclient
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Shared by every batch on this loop, so overlapping coalesced
+        # flushes stay under max_concurrency together
+        loop = asyncio.get_running_loop()
+        if self._sem is None or self._sem_loop is not loop:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+            self._sem_loop = loop
+        return self._sem
+
+    async def aclose(self) -> None:
+        """Close the async client of the current loop; async callers call this when done."""
+        if self._aclient is not None:
+            await self._aclient.close()
+        self._aclient = None
+        self._aclient_loop = None
+
+    async def acall_llm(self, prompt: str, max_tokens: int = 256, strict: bool = False,
+                        json_mode: bool = False, model: Optional[str] = None) -> str:
+        request = self._request(prompt, max_tokens, strict, json_mode, model)
+
+        async def attempt() -> str:
+            response = await self._async_client().chat.completions.create(**request)
+            if not request["stream"]:
+                return response.choices[0].message.content.strip()
+            reader = _StreamReader()
+            try:
+                async for chunk in response:
+                    if reader.feed(chunk):
+                        break
+            finally:
+                await response.close()
+            return reader.text()
+
+        return await _awith_retries(attempt)
 
     # ---------------- JSON EXTRACTION (BULLETPROOF) ----------------
     def extract_json(self, content: str, expect_array: bool = False):
-        content = re.sub(r"```json", "", content, flags=re.IGNORECASE)
-        content = re.sub(r"```", "", content).strip()
+        # JSON mode responses parse as-is; the slicing below only runs for
+        # replies that came back wrapped in fences or prose
+        try:
+            obj = _loads(content)
+        except json.JSONDecodeError:
+            obj = self._extract_loose(content, expect_array)
 
-        decoder = json.JSONDecoder()
-        obj, _ = decoder.raw_decode(content)
+        if expect_array and isinstance(obj, dict):
+            obj = obj.get("results")
 
         if expect_array and not isinstance(obj, list):
             raise ValueError("Expected JSON array but got object")
@@ -158,40 +891,65 @@ Inputs:
 
         return obj
 
+    def _extract_loose(self, content: str, expect_array: bool = False):
+        # Slice from the first opening to the last closing bracket of the
+        # expected kind; this drops fences and prose around the value without
+        # scanning it with regexes. A batch reply may be the {"results": ...}
+        # wrapper or a bare array.
+        bare_array = expect_array and '"results"' not in content
+        opener, closer = ("[", "]") if bare_array else ("{", "}")
+        start = content.find(opener)
+        end = content.rfind(closer)
+        if 0 <= start < end:
+            content = content[start:end + 1]
+        else:
+            content = _FENCE_RE.sub("", content).strip()
+
+        try:
+            return _loads(content)
+        except json.JSONDecodeError:
+            # Trailing text after the JSON value: stop at the end of the first one
+            return _DECODER.raw_decode(content)[0]
+
     # ---------------- VALIDATION ----------------
     def validate_and_fix(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        def clean(v):
-            if v in [None, "", "null", "None", "N/A"]:
-                return None
-            return str(v).strip()
+        result = dict.fromkeys(_FIELDS)
 
-        result = {}
-
-        result["material_name"] = clean(data.get("material_name"))
+        for k in _STR_FIELDS:
+            result[k] = _clean(data.get(k))
 
+        # Numbers from the decoder need no string round-trip
+        q = data.get("quantity")
         try:
-            q = data.get("quantity")
-            result["quantity"] = int(float(q)) if q is not None else None
-        except:
+            if isinstance(q, (int, float)):
+                result["quantity"] = int(q)
+            elif isinstance(q, str) and q.strip():
+                q = q.strip()
+                result["quantity"] = int(q) if q.isdigit() else int(float(q))
+        except (ValueError, OverflowError):
             result["quantity"] = None
 
-        result["unit"] = clean(data.get("unit"))
-        result["project_name"] = clean(data.get("project_name"))
-        result["location"] = clean(data.get("location"))
-
-        urgency = str(data.get("urgency", "low")).lower()
-        result["urgency"] = urgency if urgency in ["low", "medium", "high"] else "low"
+        urgency = str(data.get("urgency", "low")).strip().lower()
+        result["urgency"] = urgency if urgency in _URGENCIES else "low"
 
         result["deadline"] = self.validate_date(data.get("deadline"))
 
         return result
 
     def validate_date(self, value):
-        if not value:
+        if not value or not isinstance(value, str):
             return None
+        value = value.strip()
+        # Common case: already YYYY-MM-DD, only check it is a real date
+        if _ISO_DATE_RE.match(value):
+            try:
+                date.fromisoformat(value)
+                return value
+            except ValueError:
+                return None
         try:
-            return datetime.fromisoformat(str(value)).strftime("%Y-%m-%d")
-        except:
+            return datetime.fromisoformat(value).strftime("%Y-%m-%d")
+        except ValueError:
             return None
 
     # ---------------- FALLBACK ----------------
@@ -207,9 +965,92 @@ Inputs:
         }
 
 
+# ---------------- MULTI-FILE ----------------
+def _process_shard(args: Tuple[str, str, Dict[str, Any]]) -> int:
+    input_path, output_path, parser_kwargs = args
+    return MaterialRequestParser(**parser_kwargs).process_file(input_path, output_path)
+
+
+def _divide_concurrency(parser_kwargs: Dict[str, Any], processes: int) -> None:
+    # Per-process network concurrency shrinks so the total stays under the
+    # same Groq rate limit
+    total = parser_kwargs.pop("max_concurrency", 20)
+    parser_kwargs["max_concurrency"] = max(1, total // processes)
+
+
+def process_files(input_paths: List[str], processes: Optional[int] = None,
+                  **parser_kwargs) -> Dict[str, int]:
+    """
+    Parse several request files in parallel, one process per file.
+    Each input is written next to itself as <name>.parsed.jsonl. Per-process
+    network concurrency is divided by the process count so the total
+    stays under the same Groq rate limit.
+    """
+    outputs = [os.path.splitext(path)[0] + ".parsed.jsonl" for path in input_paths]
+    # Two workers on one output would truncate each other's results
+    seen: Dict[str, str] = {}
+    for path, out in zip(input_paths, outputs):
+        key = os.path.normcase(os.path.abspath(out))
+        if key in seen:
+            raise ValueError(f"{seen[key]} and {path} would both be written to {out}")
+        seen[key] = path
+
+    processes = min(processes or os.cpu_count() or 1, len(input_paths)) or 1
+    _divide_concurrency(parser_kwargs, processes)
+
+    jobs = [(path, out, parser_kwargs) for path, out in zip(input_paths, outputs)]
+    with Pool(processes=processes) as pool:
+        counts = pool.map(_process_shard, jobs)
+
+    return dict(zip(input_paths, counts))
+
+
+def process_file_sharded(input_path: str, output_path: str, processes: Optional[int] = None,
+                         **parser_kwargs) -> int:
+    """
+    Parse one large request file across processes. Its non-blank lines are
+    cut into contiguous shards, each shard runs in its own process and event
+    loop, and the shard outputs are concatenated in input order.
+    """
+    if os.path.exists(output_path) and os.path.samefile(input_path, output_path):
+        raise ValueError(f"Output path is the input file: {output_path}")
+
+    with open(input_path, encoding="utf-8") as src:
+        lines = [s for s in (raw.strip() for raw in src) if s]
+
+    processes = min(processes or os.cpu_count() or 1, len(lines)) or 1
+    _divide_concurrency(parser_kwargs, processes)
+    size = -(-len(lines) // processes)
+
+    with tempfile.TemporaryDirectory(prefix="parser_shards_") as tmp:
+        jobs = []
+        for n in range(processes):
+            shard_path = os.path.join(tmp, f"{n}.txt")
+            with open(shard_path, "w", encoding="utf-8") as shard:
+                shard.write("\n".join(lines[n * size:(n + 1) * size]))
+            jobs.append((shard_path, os.path.join(tmp, f"{n}.jsonl"), parser_kwargs))
+
+        with Pool(processes=processes) as pool:
+            counts = pool.map(_process_shard, jobs)
+
+        with open(output_path, "w", encoding="utf-8") as out:
+            for _, shard_output, _ in jobs:
+                with open(shard_output, encoding="utf-8") as part:
+                    shutil.copyfileobj(part, out)
+
+    return sum(counts)
+
+
 # ---------------- EXAMPLE USAGE ----------------
 def main():
-    parser = MaterialRequestParser()
+    parser = MaterialRequestParser(cache_path=".parser_cache.sqlite")
+
+    # python solution.py input.txt [output.jsonl]
+    if len(sys.argv) > 1:
+        output_path = sys.argv[2] if len(sys.argv) > 2 else "outputs.jsonl"
+        count = parser.process_file(sys.argv[1], output_path)
+        print(f"Wrote {count} results to {output_path}")
+        return
 
     text = """Create 25mm steel bars, 120 units for Project Phoenix, required before 15th March
 Need 350 bags of Ultratech Cement 50kg for the site Mumbai-West urgently in 7 days
@@ -219,7 +1060,7 @@ need rebar 10mm urgently"""
 
     result = parser.parse(text)
 
-    print(json.dumps(result, indent=2))
+    print(_dumps(result, indent=True))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+import importlib.util
+import json
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_HAS_DEPS = all(importlib.util.find_spec(m) for m in ("groq", "httpx"))
+if _HAS_DEPS:
+    import solution
+
+
+def _response(content):
+    message = types.SimpleNamespace(content=content)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+_ROW = {"material_name": "plaster", "quantity": 5, "unit": "bags",
+        "urgency": "high", "deadline": None}
+
+
+@unittest.skipUnless(_HAS_DEPS, "groq and httpx are required")
+class RequestKwargsTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = solution.MaterialRequestParser(api_key="test", stream=True)
+
+    def _assert_sendable(self, kwargs):
+        # Groq rejects stream=True together with JSON mode
+        if "response_format" in kwargs:
+            self.assertFalse(kwargs["stream"])
+
+    def test_single_json_mode_call_is_not_streamed(self):
+        create = mock.Mock(return_value=_response(json.dumps(_ROW)))
+        self.parser.client = types.SimpleNamespace(
+            chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+
+        result = self.parser.parse("please send plaster to the site")
+
+        self.assertEqual(result["material_name"], "plaster")
+        kwargs = create.call_args.kwargs
+        self.assertEqual(kwargs["response_format"], {"type": "json_object"})
+        self.assertEqual(kwargs["temperature"], 0)
+        self._assert_sendable(kwargs)
+
+    def test_batch_json_mode_calls_are_not_streamed(self):
+        create = mock.AsyncMock(
+            return_value=_response(json.dumps({"results": [_ROW, _ROW]})))
+        client = types.SimpleNamespace(
+            chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)),
+            close=mock.AsyncMock())
+
+        with mock.patch.object(self.parser, "_async_client", return_value=client):
+            results = self.parser.parse("please send plaster\nplease send more plaster")
+
+        self.assertEqual(len(results), 2)
+        self.assertTrue(create.call_args_list)
+        for call in create.call_args_list:
+            self.assertIn("response_format", call.kwargs)
+            self._assert_sendable(call.kwargs)
+
+
+if __name__ == "__main__":
+    unittest.main()